@@ -3,13 +3,20 @@ AI Agent that generates custom bank statement parsers
 """
 import os
 import sys
+import hashlib
+import functools
 import argparse
+import tempfile
 import pandas as pd
-import importlib.util
 from pathlib import Path
-from typing import Tuple, Optional
+from typing import Callable, Tuple, Optional
 from dotenv import load_dotenv
 
+from agent_utils import (
+    FenceStripper, check_columns, check_dtypes, check_shape, check_values,
+    errors_similar, frame_hash, score_error,
+)
+
 # Load environment variables
 load_dotenv()
 
@@ -21,65 +28,124 @@ load_dotenv()
 # Option 2: Google Gemini
 import google.generativeai as genai
 genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-model = genai.GenerativeModel('gemini-2.0-flash')
+# Provider/model in use; part of the LLM cache key, update it when switching
+MODEL_NAME = "gemini/gemini-2.0-flash"
+model = genai.GenerativeModel(MODEL_NAME.split("/", 1)[1])
+
+# LLM responses keyed by sha256 of the model name and prompt
+LLM_CACHE_DIR = Path(".llm_cache")
 
+# Self-correction tuning (scores from score_error, lower is better)
+CONVERGENCE_EPS = 1            # score change below this means no progress
+CONVERGENCE_SIMILARITY = 0.95  # error messages this similar count as the same
+ROLLBACK_DELTA = 0             # score increase above this rolls back to prior code
 
-def call_llm(prompt: str) -> str:
-    """Call LLM and return generated text"""
+
+def call_llm(prompt: str, use_cache: bool = True,
+             on_chunk: Optional[Callable[[str], None]] = None) -> str:
+    """Call LLM and return generated text (cached on disk by model + prompt hash)
+    
+    The response is streamed; each piece of text is passed to on_chunk as
+    it arrives so callers can work on it while the rest is generated.
+    """
+    cache_key = hashlib.sha256(f"{MODEL_NAME}\n{prompt}".encode()).hexdigest()
+    cache_path = LLM_CACHE_DIR / f"{cache_key}.txt"
+    if use_cache and cache_path.exists():
+        print("⚡ Using cached LLM response")
+        text = cache_path.read_text()
+        if on_chunk:
+            on_chunk(text)
+        return text
+    
     try:
         # For Anthropic Claude:
         # response = client.messages.create(
-        #     model="claude-sonnet-4-5-20250929",
+        #     model="claude-sonnet-4-5-20250929",  # and set MODEL_NAME to match
         #     max_tokens=4000,
         #     messages=[{"role": "user", "content": prompt}]
         # )
         # return response.content[0].text
         
         # For Google Gemini:
-        response = model.generate_content(prompt)
-        return response.text
+        chunks = []
+        for chunk in model.generate_content(prompt, stream=True):
+            chunks.append(chunk.text)
+            if on_chunk:
+                on_chunk(chunk.text)
+        text = "".join(chunks)
         
     except Exception as e:
         print(f"❌ LLM Error: {e}")
         sys.exit(1)
+    
+    if use_cache:
+        LLM_CACHE_DIR.mkdir(exist_ok=True)
+        cache_path.write_text(text)
+    return text
 
 
+@functools.lru_cache(maxsize=8)
 def peek_pdf_structure(pdf_path: str) -> str:
-    """Quick analysis of PDF structure"""
+    """Quick analysis of PDF structure (cached, the PDF doesn't change)"""
     import pdfplumber
+    from pdfminer.pdftypes import resolve1
     
     try:
-        with pdfplumber.open(pdf_path) as pdf:
+        # Only page 1 is materialized; the page count comes from the page tree
+        with pdfplumber.open(pdf_path, pages=[1]) as pdf:
+            n_pages = resolve1(pdf.doc.catalog["Pages"])["Count"]
             page = pdf.pages[0]
-            text_sample = page.extract_text()[:500]
-            tables = page.extract_tables()
+            # extract_text() returns None for pages without a text layer
+            text_sample = (page.extract_text() or '')[:500]
+            # Table detection only; cell text is never extracted here
+            tables = page.find_tables()
             
             structure = f"""
-PDF has {len(pdf.pages)} page(s)
+PDF has {n_pages} page(s)
 First page text sample:
 {text_sample}
 
 Number of tables detected: {len(tables)}
 """
             if tables:
-                structure += f"First table has {len(tables[0])} rows"
+                structure += f"First table has {len(tables[0].rows)} rows"
             
             return structure
     except Exception as e:
         return f"Could not analyze PDF: {e}"
 
 
-def build_prompt(pdf_path: str, csv_path: str, 
+@functools.lru_cache(maxsize=8)
+def _prompt_constants(csv_path: str) -> dict:
+    """Expected output and its prompt strings, computed once per CSV"""
+    df = pd.read_csv(csv_path)
+    return {
+        'cols': df.columns.tolist(),
+        'dtypes': str(df.dtypes.to_dict()),
+        'head': df.head(3).to_string(),
+        'nrows': len(df),
+        'df': df,
+    }
+
+
+def build_prompt(pdf_structure: str, csv_path: str,
                  previous_code: Optional[str] = None,
                  error_msg: Optional[str] = None,
-                 attempt: int = 1) -> str:
-    """Build prompt for LLM to generate parser"""
+                 attempt: int = 1,
+                 previous_attempt: Optional[int] = None,
+                 rolled_back_from: Optional[int] = None) -> str:
+    """Build prompt for LLM to generate parser
     
-    # Read expected output
-    expected_df = pd.read_csv(csv_path)
-    pdf_structure = peek_pdf_structure(pdf_path)
+    previous_attempt is the attempt that produced previous_code (defaults
+    to attempt - 1). rolled_back_from names a later attempt that did worse
+    and was discarded in favour of previous_code.
+    """
+    if previous_attempt is None:
+        previous_attempt = attempt - 1
+    
+    expected = _prompt_constants(csv_path)
     
-    prompt = f"""You are a Python coding expert. Write a complete Python parser function.
+    chunks = [f"""You are a Python coding expert. Write a complete Python parser function.
 
 TASK: Create a function `parse(pdf_path)` that extracts bank statement data from PDF.
 
@@ -90,18 +156,18 @@ IMPORTANT: This PDF has MULTIPLE PAGES with DUPLICATE HEADERS on each page.
 You MUST skip the header row on each page individually to avoid duplicate headers in your final data.
 
 REQUIRED OUTPUT SCHEMA:
-Columns: {expected_df.columns.tolist()}
-Data types: {expected_df.dtypes.to_dict()}
-Expected rows: {len(expected_df)} (EXACTLY this many rows, no more, no less)
+Columns: {expected['cols']}
+Data types: {expected['dtypes']}
+Expected rows: {expected['nrows']} (EXACTLY this many rows, no more, no less)
 
 SAMPLE EXPECTED OUTPUT (first 3 rows):
-{expected_df.head(3).to_string()}
+{expected['head']}
 
 REQUIREMENTS:
 1. Function signature: def parse(pdf_path: str) -> pd.DataFrame
-2. Use pdfplumber library to extract tables
+2. Use PyMuPDF (import fitz) to extract tables with page.find_tables() - it is much faster than pdfplumber
 3. Return pandas DataFrame matching the schema EXACTLY
-4. Column names must match exactly: {expected_df.columns.tolist()}
+4. Column names must match exactly: {expected['cols']}
 5. Handle data type conversions (dates, numbers)
 6. Clean the data (remove nulls, strip whitespace)
 7. Include proper imports at the top
@@ -109,17 +175,22 @@ REQUIREMENTS:
 
 RECOMMENDED APPROACH:
 ```python
-for page in pdf.pages:
-    table = page.extract_table()
-    if table:
-        for row in table[1:]:  # Skip header on each page
-            all_data.append(row)
+doc = fitz.open(pdf_path)
+try:
+    for page in doc:
+        for table in page.find_tables():
+            rows = table.extract()
+            if not table.header.external:
+                rows = rows[1:]  # Skip header on each page
+            all_data.extend(rows)
+finally:
+    doc.close()
 ```
 
 CODE TEMPLATE:
 ```python
 import pandas as pd
-import pdfplumber
+import fitz  # PyMuPDF
 from typing import Any
 
 def parse(pdf_path: str) -> pd.DataFrame:
@@ -127,13 +198,19 @@ def parse(pdf_path: str) -> pd.DataFrame:
     # Your code here
     pass
 ```
-"""
+"""]
 
     # Add error correction context
     if previous_code and error_msg:
-        prompt += f"""
+        if rolled_back_from is not None:
+            chunks.append(f"""
+
+↩️ ATTEMPT {rolled_back_from} WAS WORSE THAN ATTEMPT {previous_attempt} AND WAS DISCARDED.
+Start again from attempt {previous_attempt} below and take a different approach than attempt {rolled_back_from}.""")
+        
+        chunks.append(f"""
 
-❌ PREVIOUS ATTEMPT {attempt-1} FAILED WITH ERROR:
+❌ PREVIOUS ATTEMPT {previous_attempt} FAILED WITH ERROR:
 {error_msg}
 
 PREVIOUS CODE THAT FAILED:
@@ -144,31 +221,70 @@ PREVIOUS CODE THAT FAILED:
 INSTRUCTIONS FOR FIX:
 - Analyze the error above carefully
 - If you get "Shape mismatch" with more rows than expected, you're likely including duplicate headers from multiple PDF pages
-- Process each page individually: for page in pdf.pages: ... for row in table[1:]: ...
+- Process each page individually: for page in doc: ... for table in page.find_tables(): ... rows[1:] ...
 - If you get "DataFrames not exactly equal" check for NaN vs 0.0 issues - use float('nan') for empty values, not 0.0
+- If you get "Dtype mismatch" convert the listed columns to the expected types
 - Make sure column names match EXACTLY
 - Ensure data types are correct
 - The PDF has multiple pages with headers on each page - skip them all
 - Test your logic mentally before responding
 
 NOW WRITE THE CORRECTED CODE:
-"""
+""")
     
-    prompt += """
+    chunks.append("""
 
 CRITICAL: Return ONLY the Python code, nothing else. No explanations, no markdown.
 Start directly with 'import' statements.
-"""
+""")
     
-    return prompt
+    return "".join(chunks)
 
 
-def save_parser(code: str, bank: str) -> str:
-    """Save generated parser code to file"""
+def _parser_file(bank: str) -> Path:
+    """Path of the generated parser for a bank"""
     parser_dir = Path("custom_parser")
     parser_dir.mkdir(exist_ok=True)
+    return parser_dir / f"{bank}_parser.py"
+
+
+def generate_parser(prompt: str, bank: str,
+                    use_cache: bool = True) -> Tuple[str, str]:
+    """Stream LLM output straight into the parser file, return (code, path)
+    
+    Code streams into a temp file next to the parser, which replaces the
+    parser only once the full response is in. A failed call (call_llm
+    exits) leaves the existing parser untouched.
+    """
+    parser_path = _parser_file(bank)
+    
+    tmp = tempfile.NamedTemporaryFile(
+        'w', dir=parser_path.parent, prefix=f".{parser_path.name}.",
+        suffix=".tmp", delete=False
+    )
+    try:
+        with tmp:
+            stripper = FenceStripper(tmp)
+            call_llm(prompt, use_cache=use_cache, on_chunk=stripper.feed)
+            code = stripper.close()
+        # NamedTemporaryFile is created 0600; give the parser the mode a
+        # plain open() would have
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp.name, 0o666 & ~umask)
+        os.replace(tmp.name, parser_path)
+    except BaseException:
+        # Includes SystemExit from call_llm
+        os.unlink(tmp.name)
+        raise
     
-    parser_path = parser_dir / f"{bank}_parser.py"
+    print(f"💾 Saved parser to: {parser_path}")
+    return code, str(parser_path)
+
+
+def save_parser(code: str, bank: str) -> str:
+    """Save generated parser code to file"""
+    parser_path = _parser_file(bank)
     
     with open(parser_path, 'w') as f:
         f.write(code)
@@ -177,62 +293,44 @@ def save_parser(code: str, bank: str) -> str:
     return str(parser_path)
 
 
+def load_parser(code: str, parser_path: str) -> Callable[[str], pd.DataFrame]:
+    """Compile parser code into a fresh namespace and return its parse()
+    
+    Unlike importing, nothing is cached in sys.modules, so every attempt
+    runs its own code and never a previous attempt's broken module.
+    """
+    namespace = {"__name__": "generated_parser", "__file__": parser_path}
+    exec(compile(code, parser_path, "exec"), namespace)
+    return namespace["parse"]
+
+
 def test_parser(parser_path: str, pdf_path: str, 
-                expected_df: pd.DataFrame) -> Tuple[bool, Optional[str]]:
+                expected_df: pd.DataFrame,
+                expected_hash: Optional[bytes] = None) -> Tuple[bool, Optional[str]]:
     """Test if generated parser produces correct output"""
     
     try:
-        # Dynamically import the generated parser
-        spec = importlib.util.spec_from_file_location("custom_parser", parser_path)
-        parser_module = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(parser_module)
+        # Load the generated parser into a fresh namespace
+        parse = load_parser(Path(parser_path).read_text(), parser_path)
         
         # Run the parse function
         print("🧪 Running parse function...")
-        actual_df = parser_module.parse(pdf_path)
+        actual_df = parse(pdf_path)
         
         # Validate output
         if not isinstance(actual_df, pd.DataFrame):
             return False, f"parse() returned {type(actual_df)}, expected DataFrame"
         
-        # Check columns
-        if list(actual_df.columns) != list(expected_df.columns):
-            return False, f"""
-Column mismatch!
-Expected: {list(expected_df.columns)}
-Got: {list(actual_df.columns)}
-"""
+        # Cheapest checks first, stop at the first failure so the LLM
+        # gets one targeted error instead of a generic dump
+        values_check = functools.partial(check_values, expected_hash=expected_hash)
+        for check in (check_columns, check_shape, check_dtypes, values_check):
+            ok, error = check(actual_df, expected_df)
+            if not ok:
+                return False, error
         
-        # Check shape
-        if actual_df.shape != expected_df.shape:
-            return False, f"""
-Shape mismatch!
-Expected: {expected_df.shape} (rows, cols)
-Got: {actual_df.shape}
-"""
-        
-        # Check if DataFrames are equal
-        if expected_df.equals(actual_df):
-            print("✅ Perfect match!")
-            return True, None
-        
-        # If not exactly equal, provide detailed comparison
-        error_details = f"""
-DataFrames not exactly equal. Differences found:
-
-Expected first row:
-{expected_df.iloc[0].to_dict()}
-
-Actual first row:
-{actual_df.iloc[0].to_dict()}
-
-Expected dtypes:
-{expected_df.dtypes.to_dict()}
-
-Actual dtypes:
-{actual_df.dtypes.to_dict()}
-"""
-        return False, error_details
+        print("✅ Perfect match!")
+        return True, None
         
     except Exception as e:
         import traceback
@@ -246,7 +344,7 @@ Traceback:
         return False, error_msg
 
 
-def agent_loop(bank: str, max_attempts: int = 3) -> bool:
+def agent_loop(bank: str, max_attempts: int = 3, use_cache: bool = True) -> bool:
     """
     Main agent loop: generate -> test -> self-correct
     """
@@ -267,12 +365,22 @@ def agent_loop(bank: str, max_attempts: int = 3) -> bool:
     print(f"📊 CSV: {csv_path}")
     
     # Load expected output
-    expected_df = pd.read_csv(csv_path)
+    expected_df = _prompt_constants(csv_path)['df']
     print(f"✓ Expected output: {expected_df.shape[0]} rows, {expected_df.shape[1]} columns")
+    expected_hash = frame_hash(expected_df)
     
-    # Self-correction loop
+    # PDF and CSV don't change between attempts, so inspect the PDF once
+    # (the CSV's prompt strings are cached by _prompt_constants)
+    pdf_structure = peek_pdf_structure(pdf_path)
+    
+    # Self-correction loop. The "previous" attempt is the one fed back to
+    # the LLM: the latest attempt, or an earlier one after a rollback
     previous_code = None
-    error_msg = None
+    previous_error = None
+    previous_score = None
+    previous_attempt = None
+    rolled_back_from = None  # attempt discarded in favour of previous_code
+    buffer: list[Tuple[str, str, int]] = []  # (code, error, score) per failed attempt
     
     for attempt in range(1, max_attempts + 1):
         print(f"\n{'='*60}")
@@ -281,46 +389,66 @@ def agent_loop(bank: str, max_attempts: int = 3) -> bool:
         
         # Build prompt with context from previous attempts
         prompt = build_prompt(
-            pdf_path=pdf_path,
+            pdf_structure=pdf_structure,
             csv_path=csv_path,
             previous_code=previous_code,
-            error_msg=error_msg,
-            attempt=attempt
+            error_msg=previous_error,
+            attempt=attempt,
+            previous_attempt=previous_attempt,
+            rolled_back_from=rolled_back_from
         )
         
-        # Generate parser code
+        # Generate parser code, writing it to disk while it streams in
         print("🤖 Asking LLM to generate parser code...")
-        generated_code = call_llm(prompt)
-        
-        # Clean up code (remove markdown if present)
-        if "```python" in generated_code:
-            generated_code = generated_code.split("```python")[1].split("```")[0]
-        elif "```" in generated_code:
-            generated_code = generated_code.split("```")[1].split("```")[0]
-        generated_code = generated_code.strip()
-        
+        generated_code, parser_path = generate_parser(prompt, bank, use_cache=use_cache)
         print(f"✓ Generated {len(generated_code)} characters of code")
         
-        # Save parser
-        parser_path = save_parser(generated_code, bank)
-        
         # Test parser
         print("🧪 Testing generated parser...")
-        success, error_msg = test_parser(parser_path, pdf_path, expected_df)
+        success, error_msg = test_parser(parser_path, pdf_path, expected_df, expected_hash)
         
         if success:
             print(f"\n🎉 SUCCESS on attempt {attempt}!")
             print(f"✅ Parser saved to: {parser_path}")
             return True
-        else:
-            print(f"\n❌ Attempt {attempt} failed:")
-            print(error_msg)
-            previous_code = generated_code
+        
+        score = score_error(error_msg)
+        print(f"\n❌ Attempt {attempt} failed (score {score}):")
+        print(error_msg)
+        buffer.append((generated_code, error_msg, score))
+        
+        if previous_code is not None:
+            # Converged: same error again, another attempt won't help
+            if (abs(score - previous_score) < CONVERGENCE_EPS
+                    and errors_similar(error_msg, previous_error, CONVERGENCE_SIMILARITY)):
+                print("\n🛑 Same error as the previous attempt, stopping early")
+                break
             
-            if attempt < max_attempts:
-                print(f"\n🔧 Will retry with error feedback...")
+            # Oscillating: LLM went back to the code from two attempts ago
+            if len(buffer) >= 3 and generated_code == buffer[-3][0]:
+                print("\n🛑 Attempts are oscillating, stopping early")
+                break
+        
+        if previous_code is not None and score > previous_score + ROLLBACK_DELTA:
+            # Regressed: keep feeding back the better attempt
+            print(f"\n↩️ Attempt {attempt} is worse than attempt {previous_attempt}, rolling back")
+            rolled_back_from = attempt
+        else:
+            previous_code, previous_error = generated_code, error_msg
+            previous_score, previous_attempt = score, attempt
+            rolled_back_from = None
+        
+        if attempt < max_attempts:
+            print(f"\n🔧 Will retry with error feedback...")
     
-    print(f"\n💔 Failed after {max_attempts} attempts")
+    # Keep the closest attempt on disk rather than whichever came last
+    if buffer:
+        best_code, _, best_score = min(buffer, key=lambda entry: entry[2])
+        if best_code != buffer[-1][0]:
+            print(f"\n📌 Restoring best attempt (score {best_score})")
+            save_parser(best_code, bank)
+    
+    print(f"\n💔 Failed after {len(buffer)} attempts")
     return False
 
 
@@ -341,11 +469,16 @@ def main():
         default=3,
         help="Maximum correction attempts (default: 3)"
     )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always call the LLM instead of reusing cached responses"
+    )
     
     args = parser.parse_args()
     
     # Run agent
-    success = agent_loop(args.target, args.max_attempts)
+    success = agent_loop(args.target, args.max_attempts, use_cache=not args.no_cache)
     
     sys.exit(0 if success else 1)
 
@@ -0,0 +1,263 @@
+"""
+Helpers shared by agent.py and the tests (pandas/NumPy only, no LLM SDK)
+"""
+import re
+import ast
+import difflib
+import numpy as np
+import pandas as pd
+from typing import Optional, TextIO, Tuple
+
+# Markdown fence line, and the first line of a bare (unfenced) code response
+_FENCE_LINE_RE = re.compile(r"^\s*```")
+_CODE_START_RE = re.compile(r"^(?:import \w|from [\w.]+ import |def \w+\s*\(|class \w|@\w|#)")
+
+# Numbers quoted in check_* error messages, read back by score_error
+_SHAPE_RE = re.compile(r"Expected: \((\d+), (\d+)\).*?Got: \((\d+), (\d+)\)", re.DOTALL)
+_COLUMNS_RE = re.compile(r"Expected: (\[.*?\])\nGot: (\[.*?\])", re.DOTALL)
+_ROWS_DIFFER_RE = re.compile(r"(\d+) row\(s\) differ")
+
+
+def df_equals_fast(a: pd.DataFrame, b: pd.DataFrame) -> bool:
+    """NaN-aware equality like DataFrame.equals, compared column by column in NumPy"""
+    if a.shape != b.shape or list(a.columns) != list(b.columns):
+        return False
+    if not a.index.equals(b.index):
+        return False
+    # Compare pandas dtypes: to_numpy() flattens str/string/category to object
+    if not a.dtypes.equals(b.dtypes):
+        return False
+    
+    for i in range(a.shape[1]):
+        x = a.iloc[:, i].to_numpy()
+        y = b.iloc[:, i].to_numpy()
+        if x.dtype.kind in "fc":
+            if not np.array_equal(x, y, equal_nan=True):
+                return False
+        # equal_nan only works on numeric arrays, mask NaN/None by hand
+        elif not ((x == y) | (pd.isna(x) & pd.isna(y))).all():
+            return False
+    return True
+
+
+class FenceStripper:
+    """Strip markdown fences from streamed LLM output, line by line
+    
+    Code lines are written to `out` as soon as they are complete. Text
+    before an opening fence is skipped unless it already looks like code
+    (the prompt asks for bare code), and everything after the closing
+    fence is ignored. Leading comment lines are held back until real code
+    follows, so a markdown heading before a fence is not taken as code.
+    """
+    
+    def __init__(self, out: TextIO):
+        self._out = out
+        self._state = "start"  # start -> fenced | bare -> done
+        self._bare_code = False  # bare mode has seen a non-comment line
+        self._pending = ""
+        self._held: list[str] = []
+        self._skipped: list[str] = []
+        self._lines: list[str] = []
+    
+    def feed(self, text: str) -> None:
+        """Process a chunk of streamed text"""
+        self._pending += text
+        *lines, self._pending = self._pending.split("\n")
+        for line in lines:
+            self._line(line)
+    
+    def close(self) -> str:
+        """Flush the last line and return the code that was written"""
+        if self._pending:
+            self._line(self._pending)
+            self._pending = ""
+        if self._state == "start" or (self._state == "bare" and not self._bare_code):
+            # No code found; pass everything through and let testing fail
+            for line in self._skipped + self._held:
+                self._emit(line)
+        return "\n".join(self._lines).strip()
+    
+    def _line(self, line: str) -> None:
+        is_fence = _FENCE_LINE_RE.match(line) is not None
+        if self._state == "start":
+            if is_fence:
+                self._state = "fenced"
+            elif _CODE_START_RE.match(line):
+                self._state = "bare"
+                self._bare_line(line, is_fence)
+            else:
+                self._skipped.append(line)
+        elif self._state == "fenced":
+            if is_fence:
+                self._state = "done"
+            else:
+                self._emit(line)
+        elif self._state == "bare":
+            self._bare_line(line, is_fence)
+    
+    def _bare_line(self, line: str, is_fence: bool) -> None:
+        if self._bare_code:
+            if is_fence:
+                self._state = "done"
+            else:
+                self._emit(line)
+            return
+        
+        # Only comments so far, which may be a markdown heading
+        if is_fence:
+            self._drop_held()
+            self._state = "fenced"
+        elif not line.strip() or line.lstrip().startswith("#"):
+            self._held.append(line)
+        elif _CODE_START_RE.match(line):
+            self._bare_code = True
+            for held in self._held:
+                self._emit(held)
+            self._held = []
+            self._emit(line)
+        else:
+            # Prose after a heading, keep looking for the code
+            self._drop_held()
+            self._skipped.append(line)
+            self._state = "start"
+    
+    def _drop_held(self) -> None:
+        self._skipped.extend(self._held)
+        self._held = []
+    
+    def _emit(self, line: str) -> None:
+        if not self._lines and not line.strip():
+            return  # drop leading blank lines
+        self._lines.append(line)
+        self._out.write(line + "\n")
+
+
+def check_columns(actual_df: pd.DataFrame,
+                   expected_df: pd.DataFrame) -> Tuple[bool, Optional[str]]:
+    """Check column names and order"""
+    if list(actual_df.columns) == list(expected_df.columns):
+        return True, None
+    return False, f"""
+Column mismatch!
+Expected: {list(expected_df.columns)}
+Got: {list(actual_df.columns)}
+"""
+
+
+def check_shape(actual_df: pd.DataFrame,
+                 expected_df: pd.DataFrame) -> Tuple[bool, Optional[str]]:
+    """Check row and column counts"""
+    if actual_df.shape == expected_df.shape:
+        return True, None
+    return False, f"""
+Shape mismatch!
+Expected: {expected_df.shape} (rows, cols)
+Got: {actual_df.shape}
+"""
+
+
+def check_dtypes(actual_df: pd.DataFrame,
+                  expected_df: pd.DataFrame) -> Tuple[bool, Optional[str]]:
+    """Check the dtype of every column"""
+    wrong = [
+        f"  {col}: expected {expected_df[col].dtype}, got {actual_df[col].dtype}"
+        for col in expected_df.columns
+        if actual_df[col].dtype != expected_df[col].dtype
+    ]
+    if not wrong:
+        return True, None
+    return False, "\nDtype mismatch!\n" + "\n".join(wrong) + "\n"
+
+
+def frame_hash(df: pd.DataFrame) -> bytes:
+    """Hash DataFrame contents (not the index) in one vectorized pass"""
+    return pd.util.hash_pandas_object(df, index=False).values.tobytes()
+
+
+def check_values(actual_df: pd.DataFrame, expected_df: pd.DataFrame,
+                  expected_hash: Optional[bytes] = None) -> Tuple[bool, Optional[str]]:
+    """Check cell values, reporting the first row that differs"""
+    if expected_hash is None:
+        expected_hash = frame_hash(expected_df)
+    if (actual_df.shape == expected_df.shape
+            and actual_df.index.equals(expected_df.index)
+            and frame_hash(actual_df) == expected_hash):
+        # hash_pandas_object stringifies mixed object columns ([1, "2"] hashes
+        # like ["1", "2"]), so a hash hit only vouches for the other columns
+        obj = (expected_df.dtypes == object).to_numpy() | (actual_df.dtypes == object).to_numpy()
+        if not obj.any() or df_equals_fast(expected_df.loc[:, obj], actual_df.loc[:, obj]):
+            return True, None
+    
+    # Hashes are representation-sensitive (e.g. -0.0 vs 0.0), so confirm
+    # with a real comparison before reporting a failure
+    if df_equals_fast(expected_df, actual_df):
+        return True, None
+    
+    expected = expected_df.reset_index(drop=True)
+    actual = actual_df.reset_index(drop=True)
+    differs = (actual != expected) & ~(actual.isna() & expected.isna())
+    bad_rows = differs.any(axis=1)
+    
+    if not bad_rows.any():
+        return False, f"""
+DataFrames not exactly equal. All values match but the index differs:
+Expected index: {expected_df.index}
+Got index: {actual_df.index}
+"""
+    
+    row = int(bad_rows.idxmax())
+    bad_cols = differs.columns[differs.iloc[row]].tolist()
+    return False, f"""
+DataFrames not exactly equal. {int(bad_rows.sum())} row(s) differ, first at row {row} in columns {bad_cols}
+
+Expected row {row}:
+{expected.iloc[row].to_dict()}
+
+Actual row {row}:
+{actual.iloc[row].to_dict()}
+"""
+
+
+def score_error(error_msg: Optional[str]) -> int:
+    """Score a test_parser error message: 0 is a pass, lower is closer"""
+    if error_msg is None:
+        return 0
+    
+    if "DataFrames not exactly equal" in error_msg:
+        # One point per differing row, kept below the dtype score
+        match = _ROWS_DIFFER_RE.search(error_msg)
+        n_rows = int(match.group(1)) if match else 0
+        return 1 + min(n_rows, 98)
+    
+    if "Dtype mismatch" in error_msg:
+        return 100
+    
+    if "Shape mismatch" in error_msg:
+        match = _SHAPE_RE.search(error_msg)
+        if not match:
+            return 999
+        exp_rows, exp_cols, got_rows, got_cols = map(int, match.groups())
+        delta = abs(exp_rows - got_rows) + abs(exp_cols - got_cols)
+        return 100 + min(delta, 899)
+    
+    if "Column mismatch" in error_msg:
+        match = _COLUMNS_RE.search(error_msg)
+        if not match:
+            return 1999
+        try:
+            expected, got = (ast.literal_eval(group) for group in match.groups())
+        except (ValueError, SyntaxError):
+            return 1999
+        return 1000 + min(len(set(expected) ^ set(got)), 999)
+    
+    if "expected DataFrame" in error_msg:
+        return 5000
+    
+    # Code execution error
+    return 10000
+
+
+def errors_similar(error_a: str, error_b: str, threshold: float = 0.95) -> bool:
+    """Check if two error messages are (almost) the same"""
+    ratio = difflib.SequenceMatcher(None, error_a, error_b).ratio()
+    return ratio >= threshold
@@ -1,30 +1,120 @@
+import os
+import sys
+import numpy as np
 import pandas as pd
-import pdfplumber
-from typing import Any
+import fitz  # PyMuPDF
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import chain, islice
+from typing import Any, Iterable, Iterator, Optional
+
+# Rows in the expected statement; None reads every page
+TARGET_ROWS: Optional[int] = 100
+# PDFs larger than this are opened from disk instead of read into memory
+MAX_IN_MEMORY_BYTES = 100 * 1024 * 1024
+# Below this many pages, process start-up costs more than it saves
+PARALLEL_MIN_PAGES = 4
+# Transaction table area on every page (points, top-left origin), leaves out
+# the bank title above it; measured from the sample statement's cell borders
+TABLE_BBOX = fitz.Rect(5, 80, 607, 760)
+# Cells are drawn as ruled rectangles, so detect the grid from lines only
+TABLE_SETTINGS = {'strategy': 'lines', 'snap_tolerance': 3}
+
+def _to_amounts(*columns: list[Any]) -> np.ndarray:
+    '''Convert equal-length amount columns in one pass, one float64 row per column
+
+    Cells like "1,935.30" become 1935.3; blank or malformed cells become NaN.
+    '''
+    cells = pd.Series(list(chain.from_iterable(columns)), dtype=object)
+    cells = cells.str.strip().str.replace(',', '', regex=False)
+    amounts = pd.to_numeric(cells, errors='coerce').to_numpy(dtype='float64')
+    return amounts.reshape(len(columns), -1)
+
+def _open_pdf(pdf_path: str) -> fitz.Document:
+    '''Open the PDF from an in-memory copy so parsing never seeks the file'''
+    if os.path.getsize(pdf_path) > MAX_IN_MEMORY_BYTES:
+        return fitz.open(pdf_path)
+    with open(pdf_path, 'rb') as f:
+        return fitz.open(stream=f.read(), filetype='pdf')
+
+def _page_rows(page: fitz.Page) -> list[list[Any]]:
+    '''Extract table rows from one page, skipping its header'''
+    page_rows: list[list[Any]] = []
+    for table in page.find_tables(clip=TABLE_BBOX, **TABLE_SETTINGS):
+        rows = table.extract()
+        if not table.header.external:
+            rows = rows[1:]  # Skip header on each page
+        page_rows.extend(rows)
+    return page_rows
+
+def _table_rows(doc: fitz.Document) -> Iterator[list[Any]]:
+    '''Yield table rows page by page'''
+    for page in doc:
+        yield from _page_rows(page)
+
+def _extract_page(pdf_path: str, page_idx: int) -> list[list[Any]]:
+    '''Worker process: extract the rows of a single page'''
+    doc = fitz.open(pdf_path)
+    try:
+        return _page_rows(doc[page_idx])
+    finally:
+        doc.close()
+
+def _can_parallelize() -> bool:
+    '''Workers find _extract_page by module name, so it must be importable'''
+    module = sys.modules.get(__name__)
+    return getattr(module, '_extract_page', None) is _extract_page
+
+def _parallel_rows(pdf_path: str, n_pages: int, n: Optional[int]) -> list[list[Any]]:
+    '''Extract pages in a process pool, keeping page order'''
+    with ProcessPoolExecutor() as ex:
+        pages = ex.map(partial(_extract_page, pdf_path), range(n_pages))
+        rows = list(islice(chain.from_iterable(pages), n))
+        # Pages past the first n rows are not needed
+        ex.shutdown(cancel_futures=True)
+    return rows
 
 def parse(pdf_path: str) -> pd.DataFrame:
     '''Parse bank statement PDF and return DataFrame'''
-    all_data: list[list[Any]] = []
-    with pdfplumber.open(pdf_path) as pdf:
-        for page in pdf.pages:
-            table = page.extract_table()
-            if table:
-                for row in table[1:]:  # Skip header on each page
-                    all_data.append(row)
-
-    df = pd.DataFrame(all_data, columns=['Date', 'Description', 'Debit Amt', 'Credit Amt', 'Balance'])
+    return parse_rows(pdf_path, TARGET_ROWS)
 
-    # Data type conversions and cleaning
+def parse_rows(pdf_path: str, n: Optional[int] = None) -> pd.DataFrame:
+    '''Parse the first n rows of the statement (all rows if n is None)'''
+    # One list per column so pandas gets columns directly, no transpose
+    dates: list[Any] = []
+    descs: list[Any] = []
+    debits: list[Any] = []
+    credits: list[Any] = []
+    balances: list[Any] = []
+    doc = _open_pdf(pdf_path)
     try:
-        df['Debit Amt'] = pd.to_numeric(df['Debit Amt'], errors='coerce')
-        df['Credit Amt'] = pd.to_numeric(df['Credit Amt'], errors='coerce')
-        df['Balance'] = pd.to_numeric(df['Balance'], errors='coerce')
-    except:
-        pass
-
-    df = df.apply(lambda x: x.str.strip() if x.dtype == "object" else x)
-    
-    # Ensure correct number of rows
-    df = df.iloc[:100]
-
-    return df
\ No newline at end of file
+        if doc.page_count >= PARALLEL_MIN_PAGES and _can_parallelize():
+            rows: Iterable[list[Any]] = _parallel_rows(pdf_path, doc.page_count, n)
+        else:
+            # islice stops pulling pages as soon as n rows are collected
+            rows = islice(_table_rows(doc), n)
+        for row in rows:
+            dates.append(row[0])
+            descs.append(row[1])
+            debits.append(row[2])
+            credits.append(row[3])
+            balances.append(row[4])
+    finally:
+        doc.close()
+
+    debit_amt, credit_amt, balance = _to_amounts(debits, credits, balances)
+    df = pd.DataFrame({
+        'Date': dates,
+        'Description': descs,
+        'Debit Amt': debit_amt,
+        'Credit Amt': credit_amt,
+        'Balance': balance,
+    })
+
+    # Clean the text columns (by name: pandas 3 gives them the str dtype, not object).
+    # With no rows the columns are empty float64 and have no .str accessor
+    if not df.empty:
+        for col in ('Date', 'Description'):
+            df[col] = df[col].str.strip()
+
+    return df
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Tests for the agent helpers using pytest
+"""
+
+import io
+
+import numpy as np
+import pandas as pd
+
+from agent_utils import (
+    FenceStripper, check_columns, check_dtypes, check_shape, check_values,
+    df_equals_fast, errors_similar, score_error,
+)
+
+CODE = "import pandas as pd\n\ndef parse(pdf_path):\n    return pd.DataFrame()"
+
+def strip(text, chunk_size=None):
+    """Feed text through FenceStripper and return the code, checking it matches what was written"""
+    out = io.StringIO()
+    stripper = FenceStripper(out)
+    step = chunk_size or max(len(text), 1)
+    for i in range(0, len(text), step):
+        stripper.feed(text[i:i + step])
+    code = stripper.close()
+    assert out.getvalue().strip() == code, "Written code differs from returned code"
+    return code
+
+def test_fenced():
+    """A plain fenced block yields its contents"""
+    assert strip(f"```python\n{CODE}\n```") == CODE
+
+def test_prose_then_fence():
+    """Prose before the fence and after it is dropped"""
+    text = f"Here is the parser:\n\n```python\n{CODE}\n```\nLet me know if it works."
+    assert strip(text) == CODE
+
+def test_prose_starting_with_from():
+    """Prose that starts with 'from' is not taken as code"""
+    text = f"from the structure above, we need one table per page:\n```python\n{CODE}\n```"
+    assert strip(text) == CODE
+
+def test_heading_then_fence():
+    """A markdown heading before the fence is not taken as code"""
+    assert strip(f"# ICICI parser\n```python\n{CODE}\n```") == CODE
+    assert strip(f"## Solution\n\n```python\n{CODE}\n```") == CODE
+
+def test_heading_prose_then_fence():
+    """A heading followed by prose and then a fence yields the fenced code"""
+    text = f"## Solution\nThe parser below skips headers.\n```python\n{CODE}\n```"
+    assert strip(text) == CODE
+
+def test_bare_code():
+    """Unfenced code is passed through as-is"""
+    assert strip(CODE) == CODE
+
+def test_bare_code_with_leading_comment():
+    """Leading comments of bare code are kept"""
+    code = f"# ICICI parser\n{CODE}"
+    assert strip(code) == code
+
+def test_fence_split_across_chunks():
+    """Fences and lines split over several chunks are handled"""
+    text = f"## Solution\n\n```python\n{CODE}\n```\nDone."
+    for chunk_size in (1, 2, 3, 7):
+        assert strip(text, chunk_size) == CODE
+
+def test_no_code_passes_text_through():
+    """Without any code the text is kept so testing reports the problem"""
+    assert strip("Sorry, I can't help with that.") == "Sorry, I can't help with that."
+
+def _frame():
+    """Small statement-like frame with NaN/None cells"""
+    return pd.DataFrame({
+        'Date': ['01-08-2024', '02-08-2024', '03-08-2024'],
+        'Description': ['Salary', None, 'UPI'],
+        'Debit Amt': [1935.3, np.nan, 3886.08],
+    })
+
+def test_df_equals_fast_equal_with_missing():
+    """NaN in float columns and None in object columns compare equal"""
+    assert df_equals_fast(_frame(), _frame())
+
+def test_df_equals_fast_float_nan_position():
+    """A NaN against a number is a difference"""
+    other = _frame()
+    other.loc[1, 'Debit Amt'] = 0.0
+    assert not df_equals_fast(_frame(), other)
+
+def test_df_equals_fast_object_vs_string_dtype():
+    """Same text in an object and a string column is not equal, like DataFrame.equals"""
+    other = _frame()
+    other['Date'] = other['Date'].astype('string')
+    assert not _frame().equals(other)
+    assert not df_equals_fast(_frame(), other)
+
+def test_df_equals_fast_index_mismatch():
+    """Same values under a different index are not equal"""
+    other = _frame()
+    other.index = [5, 6, 7]
+    assert not df_equals_fast(_frame(), other)
+
+def test_df_equals_fast_unequal_values():
+    """Different text or columns are not equal"""
+    other = _frame()
+    other.loc[2, 'Description'] = 'IMPS'
+    assert not df_equals_fast(_frame(), other)
+    assert not df_equals_fast(_frame(), _frame().rename(columns={'Date': 'date'}))
+
+def test_check_columns():
+    """Column names and order must match"""
+    assert check_columns(_frame(), _frame()) == (True, None)
+    ok, error = check_columns(_frame()[['Description', 'Date', 'Debit Amt']], _frame())
+    assert not ok and "Column mismatch" in error
+
+def test_check_shape():
+    """Row count must match"""
+    assert check_shape(_frame(), _frame()) == (True, None)
+    ok, error = check_shape(_frame().iloc[:2], _frame())
+    assert not ok and "Shape mismatch" in error and "(2, 3)" in error
+
+def test_check_dtypes():
+    """Only the columns with a wrong dtype are listed"""
+    assert check_dtypes(_frame(), _frame()) == (True, None)
+    other = _frame()
+    other['Debit Amt'] = other['Debit Amt'].astype(object)
+    ok, error = check_dtypes(other, _frame())
+    assert not ok and "Dtype mismatch" in error
+    assert "Debit Amt" in error and "Date" not in error
+
+def test_check_values():
+    """Value errors point at the first differing row and its columns"""
+    assert check_values(_frame(), _frame()) == (True, None)
+    other = _frame()
+    other.loc[1, 'Debit Amt'] = 12.5
+    ok, error = check_values(other, _frame())
+    assert not ok
+    assert "1 row(s) differ, first at row 1 in columns ['Debit Amt']" in error
+
+def test_check_values_mixed_object_column():
+    """A hash hit on a mixed object column is not taken as equality"""
+    expected = pd.DataFrame({'Ref': ['1', '2'], 'Amt': [1.0, 2.0]})
+    actual = pd.DataFrame({'Ref': [1, '2'], 'Amt': [1.0, 2.0]})
+    assert not expected.equals(actual)
+    ok, error = check_values(actual, expected)
+    assert not ok and "first at row 0 in columns ['Ref']" in error
+
+def test_score_error_ordering():
+    """Scores rank errors: values < dtypes < shape < columns < wrong type < crash"""
+    frame = _frame()
+    wrong_value = frame.copy()
+    wrong_value.loc[0, 'Debit Amt'] = 1.0
+    wrong_dtype = frame.copy()
+    wrong_dtype['Debit Amt'] = wrong_dtype['Debit Amt'].astype(object)
+    scores = [
+        score_error(None),
+        score_error(check_values(wrong_value, frame)[1]),
+        score_error(check_dtypes(wrong_dtype, frame)[1]),
+        score_error(check_shape(frame.iloc[:2], frame)[1]),
+        score_error(check_columns(frame.rename(columns={'Date': 'date'}), frame)[1]),
+        score_error("parse() returned <class 'list'>, expected DataFrame"),
+        score_error("Code execution error: KeyError"),
+    ]
+    assert scores[0] == 0
+    assert scores == sorted(scores) and len(set(scores)) == len(scores)
+
+def test_score_error_distance():
+    """Closer shapes and column sets score lower"""
+    frame = _frame()
+    one_short = score_error(check_shape(frame.iloc[:2], frame)[1])
+    two_short = score_error(check_shape(frame.iloc[:1], frame)[1])
+    assert one_short < two_short
+    one_wrong = score_error(check_columns(frame.rename(columns={'Date': 'date'}), frame)[1])
+    two_wrong = score_error(check_columns(frame.rename(columns={'Date': 'date', 'Balance': 'x', 'Debit Amt': 'debit'}), frame)[1])
+    assert one_wrong < two_wrong
+
+def test_score_error_rows_differ():
+    """Fewer differing rows score lower, so improving value fixes don't look converged"""
+    frame = _frame()
+    one_row = frame.copy()
+    one_row.loc[0, 'Debit Amt'] = 1.0
+    two_rows = one_row.copy()
+    two_rows.loc[2, 'Debit Amt'] = 1.0
+    one_error = check_values(one_row, frame)[1]
+    two_error = check_values(two_rows, frame)[1]
+    assert score_error(one_error) < score_error(two_error)
+    assert score_error(two_error) < score_error(check_dtypes(frame.astype(object), frame)[1])
+
+def test_errors_similar():
+    """Near-identical messages are similar, different errors are not"""
+    error = check_shape(_frame().iloc[:2], _frame())[1]
+    assert errors_similar(error, error)
+    assert not errors_similar(error, "Code execution error: KeyError 'Date'")
@@ -3,12 +3,24 @@
 Test script for the bank statement parsers using pytest
 """
 
-import pandas as pd
+import os
 import sys
+import functools
+import pandas as pd
 import importlib.util
 from pathlib import Path
 import pytest
 
+from agent_utils import df_equals_fast
+
+@functools.lru_cache(maxsize=32)
+def _load_parser(parser_path: str, mtime: float):
+    """Import a parser module once per file version (mtime is the cache key)"""
+    spec = importlib.util.spec_from_file_location("custom_parser", parser_path)
+    parser_module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(parser_module)
+    return parser_module
+
 def test_icici_parser():
     """Test the ICICI parser functionality"""
     
@@ -26,9 +38,7 @@ def test_icici_parser():
     expected_df = pd.read_csv(csv_path)
     
     # Dynamically import the parser
-    spec = importlib.util.spec_from_file_location("custom_parser", parser_path)
-    parser_module = importlib.util.module_from_spec(spec)
-    spec.loader.exec_module(parser_module)
+    parser_module = _load_parser(parser_path, os.path.getmtime(parser_path))
     
     # Run the parse function
     actual_df = parser_module.parse(pdf_path)
@@ -42,6 +52,9 @@ def test_icici_parser():
     for col in expected_df.columns:
         assert actual_df[col].dtype == expected_df[col].dtype, f"Data type mismatch for column {col}: expected {expected_df[col].dtype}, got {actual_df[col].dtype}"
     
+    # Fast NumPy comparison (same check the agent uses between attempts)
+    assert df_equals_fast(expected_df, actual_df), "Parser output does not match expected CSV"
+    
     # CRITICAL: Use DataFrame.equals as specified in requirements
     assert expected_df.equals(actual_df), "Parser output does not match expected CSV via DataFrame.equals"
 
@@ -50,9 +63,7 @@ def test_parser_contract():
     parser_path = "custom_parser/icici_parser.py"
     
     # Import parser
-    spec = importlib.util.spec_from_file_location("custom_parser", parser_path)
-    parser_module = importlib.util.module_from_spec(spec)
-    spec.loader.exec_module(parser_module)
+    parser_module = _load_parser(parser_path, os.path.getmtime(parser_path))
     
     # Check function exists
     assert hasattr(parser_module, 'parse'), "Parser module must have a 'parse' function"
@@ -65,6 +76,28 @@ def test_parser_contract():
     param_name = list(sig.parameters.keys())[0]
     assert 'pdf' in param_name.lower() or 'path' in param_name.lower(), "Parameter should be pdf_path or similar"
 
+def test_parser_no_tables(tmp_path):
+    """Test that a PDF without any table gives an empty DataFrame, not an error"""
+    import fitz
+    
+    parser_path = "custom_parser/icici_parser.py"
+    csv_path = "data/icici/icici_sample.csv"
+    
+    # Blank one-page PDF
+    pdf_path = str(tmp_path / "blank.pdf")
+    doc = fitz.open()
+    doc.new_page()
+    doc.save(pdf_path)
+    doc.close()
+    
+    parser_module = _load_parser(parser_path, os.path.getmtime(parser_path))
+    actual_df = parser_module.parse(pdf_path)
+    
+    expected_columns = list(pd.read_csv(csv_path).columns)
+    assert isinstance(actual_df, pd.DataFrame), f"Expected DataFrame, got {type(actual_df)}"
+    assert list(actual_df.columns) == expected_columns, f"Column mismatch: expected {expected_columns}, got {list(actual_df.columns)}"
+    assert actual_df.empty, f"Expected no rows, got {len(actual_df)}"
+
 if __name__ == "__main__":
     # Run tests manually if not using pytest
     try: